@@ -1,28 +1,51 @@
 import os
 import shutil
 import tempfile
+import threading
 import time
-import requests
+import httpx
 import wsgiref.headers
 import docker
+import requests
 import json
+import re
+import logging
 import uuid
+import zipfile
 import psutil
 import argparse
+import atexit
 import signal
 import sys
+from collections import deque
 from dotenv import load_dotenv
 from docker.types import DeviceRequest
 
 # --- 1. GLOBAL INITIALIZATION ---
 load_dotenv()
+log = logging.getLogger("matcha-agent")
 
 try:
     import pynvml 
-    pynvml.nvmlInit()
-    HAS_GPU = True
-except:
-    HAS_GPU = False
+except ImportError:
+    pynvml = None
+
+HAS_GPU = False
+if pynvml is not None:
+    try:
+        pynvml.nvmlInit()
+        HAS_GPU = True
+        atexit.register(pynvml.nvmlShutdown)
+    except pynvml.NVMLError:
+        pass
+
+# orjson encodes straight to bytes and is several times faster than the stdlib encoder
+try:
+    import orjson
+    encode_json = orjson.dumps
+except ImportError:
+    def encode_json(obj):
+        return json.dumps(obj).encode('utf-8')
 
 # Fix for certain environments where wsgiref might be finicky
 if not hasattr(wsgiref.headers.Headers, 'items'):
@@ -41,11 +64,41 @@ def get_auth_headers():
         "Content-Type": "application/json"
     }
 
+# --- HTTP/2 clients (keep-alive TLS connections to the orchestrator) ---
+REQUEST_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+LONG_POLL_WAIT = 25  # seconds the orchestrator may hold get_task open
+HEARTBEAT_INTERVAL = 10
+IDLE_BACKOFF_MIN = 0.5  # seconds
+IDLE_BACKOFF_MAX = 15.0
+# poll_for_task() outcomes
+POLL_TASK = "task"    # Ran a task; more may be queued
+POLL_EMPTY = "empty"  # Orchestrator answered with no task (200 without one, or 204)
+POLL_ERROR = "error"  # No usable answer: network/HTTP error, or no runner available
+SHUTDOWN = threading.Event()  # Set by signal_handler so background loops stop
+
+def make_http_client():
+    return httpx.Client(
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=2,  # Connection failures only
+            limits=httpx.Limits(max_keepalive_connections=4)
+        ),
+        headers=get_auth_headers(),
+        timeout=REQUEST_TIMEOUT
+    )
+
+# One client per thread: on HTTP/2 a read timeout fails the whole connection, so a
+# stalled heartbeat sharing it would also kill the held long-poll (and its task)
+HTTP_CLIENT = make_http_client()  # Main thread: enroll, register, get_task, task_update
+HEARTBEAT_CLIENT = make_http_client()
+
 # --- Docker Initialization with User-Friendly Error ---
 try:
     client = docker.from_env()
     # This line triggers a connection test immediately
     client.ping() 
+    # Low-level client for the per-task hot path (skips the Container/Image wrappers)
+    api = client.api
 except Exception as e:
     print("\n" + "!"*60)
     print("---DOCKER NOT DETECTED---")
@@ -57,18 +110,134 @@ except Exception as e:
     print("!"*60 + "\n")
     sys.exit(1)
 
+# docker-py passes transport failures (e.g. dockerd restarting) through as
+# unwrapped requests exceptions, so Docker calls that must not crash catch both
+DOCKER_ERRORS = (docker.errors.DockerException, requests.exceptions.RequestException)
+
+# --- Runner image (pulled once at startup so the first task doesn't pay for it) ---
+RUNNER_IMAGE = "ruasnv/matcha-runner:latest"
+RUNNER_IMAGE_REFRESH_INTERVAL = 6 * 3600  # seconds
+RUNNER_IMAGE_ID = RUNNER_IMAGE  # Replaced by the resolved sha256 id once pulled
+STALE_RUNNER_IMAGES = []  # Superseded ids, removed by the main thread between tasks
+
+def pull_runner_image():
+    """Pulls the runner image and pins RUNNER_IMAGE_ID to its resolved id."""
+    global RUNNER_IMAGE_ID
+    try:
+        image = client.images.pull(RUNNER_IMAGE)
+    except docker.errors.DockerException as e:
+        print(f"⚠️ Could not pull {RUNNER_IMAGE}: {e}")
+        return
+    previous_id = RUNNER_IMAGE_ID
+    RUNNER_IMAGE_ID = image.id
+    print(f"🐳 Runner image ready: {RUNNER_IMAGE} ({image.short_id})")
+    if previous_id not in (RUNNER_IMAGE, image.id):
+        # Not removed here: the main thread may be starting a container from it
+        STALE_RUNNER_IMAGES.append(previous_id)
+
+def prune_runner_images():
+    """Removes superseded runner images; called from the main thread between tasks."""
+    for image_id in list(STALE_RUNNER_IMAGES):
+        try:
+            # Without force, dockerd refuses while any container still uses the image
+            api.remove_image(image_id)
+        except docker.errors.NotFound:
+            pass
+        except DOCKER_ERRORS as e:
+            log.debug("Keeping previous runner image %s for now: %s", image_id, e)
+            continue
+        STALE_RUNNER_IMAGES.remove(image_id)
+
+def image_refresh_loop():
+    """Picks up new runner releases without stalling task dispatch."""
+    while not SHUTDOWN.wait(RUNNER_IMAGE_REFRESH_INTERVAL):
+        try:
+            pull_runner_image()
+        except Exception as e:
+            # docker-py lets some transport errors (e.g. dockerd restarting) through
+            # unwrapped; don't let them kill the refresh thread
+            print(f"⚠️ Runner image refresh failed: {e}")
+
+# --- Runner resource limits (leave headroom so the agent's heartbeat keeps running) ---
+def get_runner_limits():
+    """cgroup limits for runner containers, sized from what the Docker daemon can see."""
+    # Docker's view, not psutil's: on Docker Desktop the VM is smaller than the host
+    info = client.info()
+    return {
+        "nano_cpus": max(info["NCPU"] - 1, 1) * 10**9,
+        "mem_limit": int(info["MemTotal"] * 0.85)
+    }
+
+RUNNER_LIMITS = get_runner_limits()
+
+# --- Optional warm runner (one long-lived container, one exec per task) ---
+# Off by default: tasks would share the container's filesystem and processes.
+REUSE_RUNNER = os.getenv("MATCHA_REUSE_RUNNER") == "1"
+WARM_RUNNER = None
+WARM_OUTPUTS_DIR = None  # Fresh host dir per runner instance, mounted at /outputs
+RUNNER_COMMAND = None  # The image's own entrypoint + cmd, exec'd for every task
+
+# --- Task output storage ---
+OUTPUTS_MIN_TMPFS_BYTES = 2 * 1024**3  # Only use /dev/shm when it has this much free
+# tmpfs pages a runner writes count against its mem_limit, so nodes producing
+# very large outputs can opt out with MATCHA_TMPFS_OUTPUTS=0
+USE_TMPFS_OUTPUTS = (
+    os.getenv("MATCHA_TMPFS_OUTPUTS", "1") != "0"
+    and sys.platform.startswith("linux")
+    and os.path.isdir("/dev/shm")
+)
+
+# Private (0700, unguessable) roots; each task gets its own mkdtemp under one of them
+DISK_OUTPUTS_ROOT = tempfile.mkdtemp(prefix="matcha-outputs-")
+TMPFS_OUTPUTS_ROOT = tempfile.mkdtemp(prefix="matcha-outputs-", dir="/dev/shm") if USE_TMPFS_OUTPUTS else None
+for _root in (DISK_OUTPUTS_ROOT, TMPFS_OUTPUTS_ROOT):
+    if _root:
+        atexit.register(shutil.rmtree, _root, ignore_errors=True)
+
+def make_outputs_dir(prefix):
+    """Creates a private outputs dir, on RAM-backed tmpfs only while it still has room."""
+    root = DISK_OUTPUTS_ROOT
+    if TMPFS_OUTPUTS_ROOT:
+        st = os.statvfs(TMPFS_OUTPUTS_ROOT)
+        if st.f_bavail * st.f_frsize >= OUTPUTS_MIN_TMPFS_BYTES:
+            root = TMPFS_OUTPUTS_ROOT
+    return tempfile.mkdtemp(prefix=prefix, dir=root)
+
+def remove_outputs_dir(path):
+    """Deletes a task outputs dir, wiping root-owned runner files from inside a container."""
+    try:
+        shutil.rmtree(path)
+        return
+    except PermissionError:
+        pass
+    try:
+        # The runner wrote these as its own user, so delete them as that user too
+        client.containers.run(
+            RUNNER_IMAGE_ID,
+            ["/outputs", "-mindepth", "1", "-delete"],
+            entrypoint=["find"],
+            volumes={path: {'bind': '/outputs', 'mode': 'rw'}},
+            remove=True
+        )
+        os.rmdir(path)
+    except (*DOCKER_ERRORS, OSError) as e:
+        print(f"⚠️ Could not remove task outputs {path}: {e}")
+
 # --- 2. HARDWARE DETECTION ---
 GPU_HANDLE = None
 GPU_NAME = "Unknown GPU"
+VRAM_TOTAL_GB = None
+# Static for the process lifetime, so computed once instead of on every heartbeat
+RAM_TOTAL_GB = round(psutil.virtual_memory().total / (1024**3), 2)
 
 if HAS_GPU:
     try:
-        pynvml.nvmlInit()
         GPU_HANDLE = pynvml.nvmlDeviceGetHandleByIndex(0)
         name_raw = pynvml.nvmlDeviceGetName(GPU_HANDLE)
         GPU_NAME = name_raw.decode('utf-8') if isinstance(name_raw, bytes) else str(name_raw)
+        VRAM_TOTAL_GB = round(pynvml.nvmlDeviceGetMemoryInfo(GPU_HANDLE).total / (1024**3), 2)
         print(f"✅ Dynamic Hardware Detection: Found {GPU_NAME}")
-    except Exception as e:
+    except pynvml.NVMLError as e:
         print(f"⚠️ GPU Initialization failed: {e}")
         HAS_GPU = False
 
@@ -82,17 +251,31 @@ def get_gpu_specs():
             name_raw = pynvml.nvmlDeviceGetName(handle)
             name = name_raw.decode('utf-8') if isinstance(name_raw, bytes) else str(name_raw)
             gpus.append({"id": f"gpu_{i}", "name": name, "status": "idle"})
-    except:
+    except pynvml.NVMLError:
         pass
     return gpus
 
+# Prime the CPU counter so non-blocking reads return the delta since the last call
+psutil.cpu_percent(interval=None)
+
+SYSTEM_SAMPLE_TTL = 0.5  # seconds
+_system_sample = {"at": 0.0, "cpu_load": None, "ram": None}
+
+def get_system_sample():
+    """Returns (cpu_load, virtual_memory), shared between callers within SYSTEM_SAMPLE_TTL."""
+    now = time.monotonic()
+    if _system_sample["ram"] is None or now - _system_sample["at"] >= SYSTEM_SAMPLE_TTL:
+        _system_sample["cpu_load"] = psutil.cpu_percent(interval=None)
+        _system_sample["ram"] = psutil.virtual_memory()
+        _system_sample["at"] = now
+    return _system_sample["cpu_load"], _system_sample["ram"]
+
 def get_telemetry():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    ram = psutil.virtual_memory()
+    cpu_usage, ram = get_system_sample()
     telemetry = {
         "cpu_load": cpu_usage,
         "ram_used_gb": round(ram.used / (1024**3), 2),
-        "ram_total_gb": round(ram.total / (1024**3), 2),
+        "ram_total_gb": RAM_TOTAL_GB,
         "status": "idle",
         "gpu": None
     }
@@ -104,18 +287,49 @@ def get_telemetry():
                 "name": GPU_NAME,
                 "load": int(util.gpu),
                 "vram_used": round(mem.used / (1024**3), 2),
-                "vram_total": round(mem.total / (1024**3), 2)
+                "vram_total": VRAM_TOTAL_GB
             }
-        except:
+        except pynvml.NVMLError:
             telemetry["gpu"] = {"name": GPU_NAME, "load": 0, "status": "offline"}
     return telemetry
 
+def get_hardware_specs():
+    """Static hardware description sent once at registration; live load comes via heartbeat."""
+    return {
+        "ram_total_gb": RAM_TOTAL_GB,
+        "cpu_count": psutil.cpu_count(logical=True),
+        "status": "idle",
+        "gpu": {"name": GPU_NAME, "vram_total": VRAM_TOTAL_GB} if GPU_HANDLE else None
+    }
+
 # --- 3. ENROLLMENT ---
+CREDENTIAL_LINE = re.compile(r"^\s*(export\s+)?(USER_ID|PROVIDER_ID)\s*=")
+
 def save_credentials(user_id):
     """Automatically persists the user_id to the local environment."""
-    with open(".env", "a") as f:
-        f.write(f"\nUSER_ID={user_id}")
-        f.write(f"\nPROVIDER_ID={PROVIDER_ID}")
+    # Rewrite instead of appending so re-enrolling never duplicates keys. Every
+    # other line is copied verbatim; only the two keys we own are replaced.
+    lines = []
+    newline = "\n"
+    if os.path.exists(".env"):
+        with open(".env", newline="") as f:
+            content = f.read()
+        if "\r\n" in content:
+            newline = "\r\n"
+        lines = [line for line in content.splitlines() if not CREDENTIAL_LINE.match(line)]
+    lines.append(f"USER_ID='{user_id}'")
+    lines.append(f"PROVIDER_ID='{PROVIDER_ID}'")
+    # .env holds the API key: create the temp file private, then keep the user's own mode
+    try:
+        os.unlink(".env.tmp")
+    except FileNotFoundError:
+        pass
+    fd = os.open(".env.tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", newline="") as f:
+        f.write(newline.join(lines) + newline)
+    if os.path.exists(".env"):
+        shutil.copymode(".env", ".env.tmp")
+    os.replace(".env.tmp", ".env")
     # Force reload the environment variables for the current process
     os.environ["USER_ID"] = user_id
     os.environ["PROVIDER_ID"] = PROVIDER_ID
@@ -124,10 +338,9 @@ def save_credentials(user_id):
 def enroll_device(token):
     print(f"🔑 Linking device {PROVIDER_ID} to Matcha Kolektif...")
     try:
-        res = requests.post(
+        res = HTTP_CLIENT.post(
             f"{ORCHESTRATOR_URL}/provider/enroll", 
-            json={"token": token, "provider_id": PROVIDER_ID},
-            headers=get_auth_headers()
+            content=encode_json({"token": token, "provider_id": PROVIDER_ID})
         )
         if res.status_code == 200:
             uid = res.json().get('user_id')
@@ -147,11 +360,11 @@ def register_provider():
     payload = {
         "provider_id": PROVIDER_ID,
         "user_id": os.getenv("USER_ID"),
-        "hardware_specs": get_telemetry(),
+        "hardware_specs": get_hardware_specs(),
         "gpus": get_gpu_specs() 
     }
     try:
-        res = requests.post(url, json=payload, headers=get_auth_headers())
+        res = HTTP_CLIENT.post(url, content=encode_json(payload))
         res.raise_for_status()
         print(f"🚀 Online as {PROVIDER_ID} ({GPU_NAME})")
     except Exception as e:
@@ -160,28 +373,52 @@ def register_provider():
 
  # --- 3. SIGNAL HANDLING ---
 def signal_handler(sig, frame):
+    """Stops the background loops and unwinds the main thread; shutdown() runs after."""
+    # No network I/O here: the interrupted frame may hold the HTTP/2 connection's read lock
+    SHUTDOWN.set()
+    raise KeyboardInterrupt
+
+def shutdown():
     """Gracefully shuts down the agent and notifies the server."""
     print("\n🛑 Disconnecting from Matcha Kolektif...")
     try:
-        # We notify the server that this provider is going offline
-        requests.post(
+        # We notify the server that this provider is going offline, on a one-off
+        # connection since the shared one may have been cut mid-read
+        httpx.post(
             f"{ORCHESTRATOR_URL}/provider/heartbeat", 
-            json={"provider_id": PROVIDER_ID, "telemetry": {"status": "offline"}},
+            content=encode_json({"provider_id": PROVIDER_ID, "telemetry": {"status": "offline"}}),
             headers=get_auth_headers(),
             timeout=2
         )
-    except:
+    except httpx.HTTPError:
+        pass
+    try:
+        stop_warm_runner()
+    except DOCKER_ERRORS:
         pass
     print("👋 Goodbye!")
-    sys.exit(0)
 
 def send_heartbeat():
     url = f"{ORCHESTRATOR_URL}/provider/heartbeat"
     payload = {"provider_id": PROVIDER_ID, "telemetry": get_telemetry()}
     try:
-        requests.post(url, json=payload, headers=get_auth_headers())
-    except:
-        pass
+        HEARTBEAT_CLIENT.post(url, content=encode_json(payload))
+    except (httpx.TimeoutException, httpx.NetworkError) as e:
+        # Expected while the orchestrator hiccups; the next beat retries
+        log.debug("Heartbeat failed: %s", e)
+    except httpx.HTTPError as e:
+        print(f"⚠️ Heartbeat failed: {e}")
+
+def heartbeat_loop():
+    """Keeps the dashboard status 'Active' while the main thread blocks on polling."""
+    while not SHUTDOWN.is_set():
+        try:
+            send_heartbeat()
+        except Exception as e:
+            # Anything send_heartbeat doesn't expect must not kill the thread, or the
+            # dashboard shows the node offline while it keeps taking tasks
+            print(f"⚠️ Heartbeat failed: {e}")
+        SHUTDOWN.wait(HEARTBEAT_INTERVAL)
 
 def update_task_status(task_id, status, logs=None, result_url=None):
     url = f"{ORCHESTRATOR_URL}/provider/task_update"
@@ -192,103 +429,289 @@ def update_task_status(task_id, status, logs=None, result_url=None):
         "details": {"stdout": logs}
     }
     try:
-        requests.post(url, json=payload, headers=get_auth_headers())
+        HTTP_CLIENT.post(url, content=encode_json(payload))
     except Exception as e:
         print(f"Failed to update task: {e}")
 
+LOG_RETAIN_BYTES = 1024 * 1024  # Tail of the container output kept for task_update
+LOG_FLUSH_LINES = 50
+LOG_FLUSH_INTERVAL = 0.1  # seconds
+
+def start_warm_runner():
+    """Starts the shared runner container that per-task execs run inside."""
+    global WARM_RUNNER, WARM_OUTPUTS_DIR, RUNNER_COMMAND
+    config = client.images.get(RUNNER_IMAGE_ID).attrs["Config"]
+    RUNNER_COMMAND = (config.get("Entrypoint") or []) + (config.get("Cmd") or [])
+    WARM_OUTPUTS_DIR = make_outputs_dir("warm-")
+    WARM_RUNNER = client.containers.run(
+        RUNNER_IMAGE_ID,
+        ["infinity"],
+        entrypoint=["sleep"],
+        detach=True,
+        volumes={WARM_OUTPUTS_DIR: {'bind': '/outputs', 'mode': 'rw'}},
+        network_mode="host",
+        **RUNNER_LIMITS,
+        device_requests=[
+            DeviceRequest(count=-1, capabilities=[['gpu']])
+        ]
+    )
+    print(f"🔥 Warm runner started: {WARM_RUNNER.short_id}")
+
+def stop_warm_runner():
+    """Removes the warm runner, if any; the next ensure_warm_runner() starts a new one."""
+    global WARM_RUNNER
+    if WARM_RUNNER is None:
+        return
+    try:
+        api.remove_container(WARM_RUNNER.id, force=True)
+    except docker.errors.NotFound:
+        pass
+    WARM_RUNNER = None
+
+def clear_warm_outputs():
+    """Empties /outputs from inside the runner, which owns the files it wrote there."""
+    exec_id = api.exec_create(WARM_RUNNER.id, ["find", "/outputs", "-mindepth", "1", "-delete"])["Id"]
+    api.exec_start(exec_id)
+    return api.exec_inspect(exec_id)["ExitCode"] == 0
+
+def ensure_warm_runner():
+    """Returns True once a running warm runner is available, restarting it if it went
+    down or recycling it onto a refreshed runner image."""
+    if WARM_RUNNER is not None:
+        try:
+            info = api.inspect_container(WARM_RUNNER.id)
+        except docker.errors.NotFound:
+            info = None
+        except DOCKER_ERRORS as e:
+            print(f"❌ Warm runner unavailable: {e}")
+            return False
+        if info is None or not info["State"]["Running"]:
+            print("⚠️ Warm runner is down, restarting it...")
+        elif RUNNER_IMAGE_ID != RUNNER_IMAGE and info["Image"] != RUNNER_IMAGE_ID:
+            print("🔄 Runner image updated, recycling the warm runner...")
+        else:
+            return True
+    try:
+        stop_warm_runner()
+        start_warm_runner()
+        return True
+    except DOCKER_ERRORS as e:
+        print(f"❌ Warm runner unavailable: {e}")
+        return False
+
+def stream_container_logs(log_stream):
+    """Echoes container output to the console in batches and returns its last LOG_RETAIN_BYTES."""
+    log_buf = deque()
+    log_size = 0
+    pending = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def flush():
+        with lock:
+            if pending:
+                sys.stdout.write("".join(pending))
+                sys.stdout.flush()
+                pending.clear()
+
+    def flusher():
+        # Deadline flush: output is never held back longer than LOG_FLUSH_INTERVAL,
+        # even while the container is quiet and the stream is blocked
+        while not done.wait(LOG_FLUSH_INTERVAL):
+            flush()
+
+    flusher_thread = threading.Thread(target=flusher, daemon=True)
+    flusher_thread.start()
+    try:
+        for chunk in log_stream:
+            log_buf.append(chunk)
+            log_size += len(chunk)
+            while log_size > LOG_RETAIN_BYTES and len(log_buf) > 1:
+                log_size -= len(log_buf.popleft())
+
+            with lock:
+                pending.append(f"🐳 {chunk.decode('utf-8', errors='replace').strip()}\n")
+                full = len(pending) >= LOG_FLUSH_LINES
+            if full:
+                flush()
+    finally:
+        done.set()
+        flusher_thread.join()
+        flush()
+    return b"".join(log_buf).decode('utf-8', errors='replace')
+
+# Already compressed (or near-incompressible model weights): deflating these only burns CPU
+STORED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4",
+    ".pt", ".pth", ".ckpt", ".safetensors", ".h5", ".onnx", ".npz"
+}
+
+def archive_results(result_dir, fileobj):
+    """Zips the contents of result_dir into an open binary file object."""
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for root, _, files in os.walk(result_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+                    compress_type = zipfile.ZIP_STORED
+                else:
+                    compress_type = zipfile.ZIP_DEFLATED
+                zf.write(path, os.path.relpath(path, result_dir), compress_type=compress_type)
+
 def poll_for_task():
+    """Polls for one task and runs it; returns POLL_TASK, POLL_EMPTY or POLL_ERROR."""
     url = f"{ORCHESTRATOR_URL}/provider/get_task"
     try:
-        response = requests.post(url, json={"provider_id": PROVIDER_ID}, headers=get_auth_headers())
+        # Don't accept work we can't run; returning early lets the main loop back off
+        if REUSE_RUNNER and not ensure_warm_runner():
+            return POLL_ERROR
+        prune_runner_images()
+
+        # Long-poll: the server holds the request until a task arrives or answers 204
+        response = HTTP_CLIENT.post(
+            url,
+            params={"wait": LONG_POLL_WAIT},
+            content=encode_json({"provider_id": PROVIDER_ID}),
+            timeout=httpx.Timeout(LONG_POLL_WAIT + 5, connect=3.0)
+        )
+        if response.status_code == 204:
+            return POLL_EMPTY
         if response.status_code != 200:
-            return False
+            return POLL_ERROR
             
         data = response.json()
         task = data.get("task")
-        if not task: return False
+        if not task: return POLL_EMPTY
 
         task_id = task['task_id']
         upload_url = task.get('upload_url') 
         print(f"📦 Assigned Task: {task_id}")
+
+        # The runner may have died while the long-poll was held
+        if REUSE_RUNNER and not ensure_warm_runner():
+            update_task_status(task_id, "FAILED", "Warm runner unavailable on provider")
+            return POLL_ERROR
         
-        result_dir = tempfile.mkdtemp()
+        if REUSE_RUNNER:
+            result_dir = WARM_OUTPUTS_DIR
+        else:
+            result_dir = make_outputs_dir("task-")
+        container = None
+        env = {
+            "PROJECT_URL": task.get('input_path'),
+            "SCRIPT_PATH": task.get('script_path', 'main.py')
+        }
         
         try:
             print(f"DEBUG: Launching runner for {task_id}...")
             print(f"DEBUG: GPU Requesting -> {task.get('input_path')}")
-            container = client.containers.run(
-            "ruasnv/matcha-runner:latest", 
-            detach=True,
-            environment={
-                "PROJECT_URL": task.get('input_path'),
-                "SCRIPT_PATH": task.get('script_path', 'main.py')
-            },
-            volumes={result_dir: {'bind': '/outputs', 'mode': 'rw'}},
-            network_mode="host",
-            # 🚀 THE CRITICAL ADDITION: Request all GPUs
-            device_requests=[
-                DeviceRequest(count=-1, capabilities=[['gpu']])
-            ]
-        )
+            if WARM_RUNNER is not None:
+                exec_id = api.exec_create(WARM_RUNNER.id, RUNNER_COMMAND, environment=env)["Id"]
+                log_stream = api.exec_start(exec_id, stream=True)
+            else:
+                container = client.containers.run(
+                RUNNER_IMAGE_ID, 
+                detach=True,
+                environment=env,
+                volumes={result_dir: {'bind': '/outputs', 'mode': 'rw'}},
+                network_mode="host",
+                **RUNNER_LIMITS,
+                # 🚀 THE CRITICAL ADDITION: Request all GPUs
+                device_requests=[
+                    DeviceRequest(count=-1, capabilities=[['gpu']])
+                ]
+            )
+                # One attach stream carries the output and ends when the container exits
+                attach_stream = api.attach(
+                    container.id, stream=True, logs=True, stdout=True, stderr=True, demux=True
+                )
+                log_stream = (chunk for pair in attach_stream for chunk in pair if chunk)
             
             update_task_status(task_id, "RUNNING")
             
             # 🚀 REAL-TIME LOG STREAMING
-            full_logs = ""
             print("--- DOCKER START ---")
-            for line in container.logs(stream=True, follow=True):
-                chunk = line.decode('utf-8')
-                print(f"🐳 {chunk.strip()}")
-                full_logs += chunk
+            full_logs = stream_container_logs(log_stream)
             print("--- DOCKER END ---")
 
-            result = container.wait(timeout=300) 
+            if WARM_RUNNER is not None:
+                exit_code = api.exec_inspect(exec_id)["ExitCode"]
+            else:
+                state = api.inspect_container(container.id)['State']
+                if state['Running']:
+                    # Output closed a moment before dockerd recorded the exit
+                    exit_code = api.wait(container.id, timeout=300)['StatusCode']
+                else:
+                    exit_code = state['ExitCode']
             
-            if result['StatusCode'] == 0:
+            if exit_code == 0:
                 print(f"✅ Execution finished. Preparing upload...")
                 
                 # Zip the result directory if it has files
-                if os.listdir(result_dir) and upload_url:
-                    zip_path = shutil.make_archive(f"results_{task_id}", 'zip', result_dir)
-                    
-                    with open(zip_path, 'rb') as f:
-                        upload_res = requests.put(
+                with os.scandir(result_dir) as it:
+                    has_outputs = next(it, None) is not None
+                if has_outputs and upload_url:
+                    # Anonymous temp file: no named archive to re-open or clean up afterwards
+                    with tempfile.TemporaryFile() as archive:
+                        archive_results(result_dir, archive)
+                        archive.seek(0)
+                        # Presigned URL on another host: don't send the orchestrator API key
+                        upload_res = httpx.put(
                             upload_url, 
-                            data=f,
-                            headers={'Content-Type': 'application/zip'}
+                            content=archive,
+                            headers={'Content-Type': 'application/zip'},
+                            timeout=REQUEST_TIMEOUT
                         )
                     
                     if upload_res.status_code == 200:
                         print("📤 Results uploaded successfully via secure tunnel.")
-                    os.remove(zip_path)
 
                 update_task_status(task_id, "COMPLETED", full_logs)
                 print(f"✨ Task {task_id} fully completed.")
             else:
-                print(f"❌ Container exited with code {result['StatusCode']}")
+                print(f"❌ Container exited with code {exit_code}")
                 update_task_status(task_id, "FAILED", full_logs)
             
-            container.remove()
+            if container is not None:
+                api.remove_container(container.id)
 
         except Exception as e:
             print(f"❌ Execution Error: {e}")
             update_task_status(task_id, "FAILED", str(e))
-            try:
-                # Attempt to kill the container if it's still hanging
-                c = client.containers.get(container.id)
-                c.stop()
-                c.remove()
-            except:
-                pass
+            if container is not None:
+                try:
+                    # Attempt to kill the container if it's still hanging
+                    api.remove_container(container.id, force=True)
+                except (docker.errors.NotFound, docker.errors.APIError):
+                    pass
         finally:
-            if os.path.exists(result_dir): 
-                shutil.rmtree(result_dir)
+            # Only the per-task subdir goes; the outputs roots are reused across tasks
+            if REUSE_RUNNER:
+                try:
+                    cleared = WARM_RUNNER is not None and clear_warm_outputs()
+                except Exception:
+                    # Any failure, including unwrapped transport errors, counts as dirty
+                    cleared = False
+                if not cleared:
+                    # Never let this task's outputs reach the next upload: retire the
+                    # runner so the next poll starts one with a fresh outputs dir
+                    print("⚠️ Could not clear warm runner outputs, replacing the runner.")
+                    try:
+                        stop_warm_runner()
+                    except DOCKER_ERRORS:
+                        pass
+            elif os.path.exists(result_dir): 
+                remove_outputs_dir(result_dir)
         
-        return True
+        return POLL_TASK
 
+    except (httpx.TimeoutException, httpx.NetworkError) as e:
+        log.debug("Polling failed: %s", e)
+        return POLL_ERROR
     except Exception as e:
         print(f"❌ Polling Error: {e}")
-        return False
+        return POLL_ERROR
 
 
 # --- 5. EXECUTION ---
@@ -297,24 +720,42 @@ if __name__ == "__main__":
     parser.add_argument("--enroll", help="The token from your Matcha Dashboard")
     args = parser.parse_args()
 
+    log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "WARNING").upper())
+    # getLevelName returns a "Level X" string for unknown names
+    logging.basicConfig(level=log_level if isinstance(log_level, int) else logging.WARNING)
+
     # 1. Set the signal trap immediately
     signal.signal(signal.SIGINT, signal_handler)
     
-    if args.enroll:
-        enroll_device(args.enroll)
+    try:
+        if args.enroll:
+            enroll_device(args.enroll)
     
-    if not os.getenv("USER_ID") and not os.path.exists(".env"):
-        print("🛑 ERROR: USER_ID not found. Run: python agent.py --enroll <token>")
-        sys.exit(1)
+        if not os.getenv("USER_ID") and not os.path.exists(".env"):
+            print("🛑 ERROR: USER_ID not found. Run: python agent.py --enroll <token>")
+            sys.exit(1)
 
-    register_provider()
-    
-    last_heartbeat = 0
-    while True:
-        # Heartbeat every 10 seconds to keep the dashboard status 'Active'
-        if time.time() - last_heartbeat >= 10:
-            send_heartbeat()
-            last_heartbeat = time.time()
-            
-        poll_for_task()
-        time.sleep(2) # Poll every 2 seconds for low latency
\ No newline at end of file
+        pull_runner_image()
+        if REUSE_RUNNER:
+            ensure_warm_runner()
+        register_provider()
+
+        threading.Thread(target=heartbeat_loop, daemon=True).start()
+        threading.Thread(target=image_refresh_loop, daemon=True).start()
+
+        idle_sleep = IDLE_BACKOFF_MIN
+        while not SHUTDOWN.is_set():
+            started = time.monotonic()
+            outcome = poll_for_task()
+            held = outcome == POLL_EMPTY and time.monotonic() - started >= 1
+            if outcome == POLL_TASK or held:
+                # Got a task (more may be queued) or the server held the long-poll: re-poll now
+                idle_sleep = IDLE_BACKOFF_MIN
+                continue
+            # An error, however slow, or an empty answer that came back immediately
+            # (no long-poll support): back off
+            SHUTDOWN.wait(idle_sleep)
+            idle_sleep = min(idle_sleep * 1.5, IDLE_BACKOFF_MAX)
+    except KeyboardInterrupt:
+        shutdown()
+        sys.exit(0)
\ No newline at end of file